@@ -170,6 +170,11 @@ class AimsunKernelVehicle(KernelVehicle):
         #           self.num_type[veh_type], ", total since start:",
         #           self.total_num_type[veh_type])
 
+        if reset:
+            self.time_counter = 0
+        else:
+            self.time_counter += 1
+
         # collect the entered and exited vehicle_ids
         added_vehicles = self.kernel_api.get_entered_ids()
         exited_vehicles = self.kernel_api.get_exited_ids()
@@ -51,6 +51,9 @@ class KernelVehicle(object):
         self.master_kernel = master_kernel
         self.kernel_api = None
         self.sim_step = sim_params.sim_step
+        # number of calls to update since the last reset, maintained by the
+        # update method of every simulator
+        self.time_counter = 0
 
     def pass_api(self, kernel_api):
         """Acquire the kernel api that was generated by the simulation kernel.
@@ -419,6 +419,10 @@ class TraCIVehicle(KernelVehicle):
         """Set the speed of the specified vehicle."""
         self.__sumo_obs[veh_id][tc.VAR_ROAD_ID] = edge
 
+    def set_leader(self, veh_id, leader):
+        """Set the leader of the specified vehicle."""
+        self.__vehicles[veh_id]["leader"] = leader
+
     def set_follower(self, veh_id, follower):
         """Set the follower of the specified vehicle."""
         self.__vehicles[veh_id]["follower"] = follower
@@ -127,7 +127,8 @@ class MultiEnv(MultiAgentEnv, Env):
         for rl_id in self.k.vehicle.get_arrived_rl_ids():
             done[rl_id] = True
             reward[rl_id] = 20 #1 #0
-            states[rl_id] = np.zeros(self.observation_space.shape[0])
+            states[rl_id] = np.zeros(
+                self.observation_space.shape[0], dtype=np.float32)
         
         return states, reward, done, infos
 
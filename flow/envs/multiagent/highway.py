@@ -5,6 +5,13 @@ from flow.core.rewards import desired_velocity, average_velocity
 from flow.envs.multiagent.base import MultiEnv
 import collections
 import os
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, the kernels below then run as plain NumPy code
+    def njit(**kwargs):
+        return lambda func: func
+
 ADDITIONAL_ENV_PARAMS = {
     # maximum acceleration of autonomous vehicles
     'max_accel': 1,
@@ -19,6 +26,53 @@ ADDITIONAL_ENV_PARAMS = {
 }
 
 
+@njit(cache=True, fastmath=True)
+def _fill_base_obs(this_speed, lead_speed, lead_head, follow_speed,
+                   follow_head, max_speed, max_length, out):
+    """Write the normalized speed and headway observations into out[:, :5].
+
+    Each argument array holds one entry per RL vehicle, and out must have
+    one row per RL vehicle.
+    """
+    out[:, 0] = this_speed / max_speed
+    out[:, 1] = (lead_speed - this_speed) / max_speed
+    out[:, 2] = lead_head / max_length
+    out[:, 3] = (this_speed - follow_speed) / max_speed
+    out[:, 4] = follow_head / max_length
+
+
+@njit(cache=True, fastmath=True)
+def _fill_merge_obs(distance, merge_distance, out):
+    """Write the distance and merge features, clipped to [-1, 1], into out.
+
+    distance holds the distance feature of each RL vehicle, while
+    merge_distance is the distance of the closest merging vehicle, shared by
+    all RL vehicles.
+    """
+    out[:, 5] = np.minimum(np.maximum(distance, -1.), 1.)
+    out[:, 6] = min(max(merge_distance, -1.), 1.)
+
+
+@njit(cache=True)
+def _mean_speed(vel):
+    """Return the mean of vel, or 0 if it is empty or holds an error value."""
+    if vel.size == 0 or (vel < -100).any():
+        return 0.
+    return vel.mean()
+
+
+def _center_dist_table(network):
+    """Return the edge -> (origin, scale) table of the distance feature.
+
+    The distance-to-merge feature of an RL vehicle on one of these edges is
+    (x - origin) / scale, where x is its position in the network.
+    """
+    center_x = network.total_edgestarts_dict["center"]
+    # FIXME implement for the other edges
+    return dict.fromkeys(
+        ["inflow_highway", "left", "center"], (center_x, center_x))
+
+
 class MultiAgentHighwayPOEnv(MultiEnv):
     """Partially observable multi-agent environment for an highway with ramps.
 
@@ -67,8 +121,23 @@ class MultiAgentHighwayPOEnv(MultiEnv):
                 raise KeyError(
                     'Environment parameter "{}" not supplied'.format(p))
 
+        # (kernel update counter, leader data) of the last call to get_state,
+        # reused by compute_reward within the same simulation step
+        self._last_obs_cache = None
+        # (kernel update counter, RL ids) of the current simulation step
+        self._step_rl_ids = None
+        # edge -> vehicle ids of the current simulation step
+        self._edge_vehs = {}
+        self._edge_vehs_counter = None
+
         super().__init__(env_params, sim_params, network, simulator)
 
+        # network invariants, fetched once instead of at every step. The
+        # normalizing constants are float32 like the observations they scale
+        self._max_speed = np.float32(self.k.network.max_speed())
+        self._max_length = np.float32(self.k.network.length())
+        self._junctions = frozenset(self.k.network.get_junction_list())
+
     @property
     def observation_space(self):
         """See class definition."""
@@ -87,67 +156,166 @@ class MultiAgentHighwayPOEnv(MultiEnv):
         """See class definition."""
         # in the warmup steps, rl_actions is None
         if rl_actions:
-            for rl_id, actions in rl_actions.items():
-                accel = actions[0]
+            rl_ids = list(rl_actions.keys())
+            accels = [actions[0] for actions in rl_actions.values()]
 
-                # lane_change_softmax = np.exp(actions[1:4])
-                # lane_change_softmax /= np.sum(lane_change_softmax)
-                # lane_change_action = np.random.choice([-1, 0, 1],
-                #                                       p=lane_change_softmax)
+            # lane_change_softmax = np.exp(actions[1:4])
+            # lane_change_softmax /= np.sum(lane_change_softmax)
+            # lane_change_action = np.random.choice([-1, 0, 1],
+            #                                       p=lane_change_softmax)
 
-                self.k.vehicle.apply_acceleration(rl_id, accel)
-                # self.k.vehicle.apply_lane_change(rl_id, lane_change_action)
+            # apply all accelerations with a single kernel call
+            self.k.vehicle.apply_acceleration(rl_ids, accels)
+            # self.k.vehicle.apply_lane_change(rl_id, lane_change_action)
 
-    def get_state(self):
-        """See class definition."""
-        obs = {}
+    def _get_rl_ids(self):
+        """Return the ids of the RL vehicles in the current simulation step.
 
-        # normalizing constants
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
+        The ids are fetched from the kernel once per step and shared by
+        get_state, compute_reward and additional_command. They are fetched
+        again whenever the vehicle kernel is updated, since this is when RL
+        vehicles enter or leave the network.
+        """
+        counter = self.k.vehicle.time_counter
+        if self._step_rl_ids is None or self._step_rl_ids[0] != counter:
+            self._step_rl_ids = (counter, list(self.k.vehicle.get_rl_ids()))
+        return self._step_rl_ids[1]
+
+    def _get_ids_by_edge(self, edges):
+        """Return the ids of the vehicles on one or several edges.
+
+        Same as self.k.vehicle.get_ids_by_edge, except that the vehicles of
+        each edge are fetched from the kernel once per simulation step, and
+        then shared by all the RL vehicles. The returned list must not be
+        modified.
+        """
+        counter = self.k.vehicle.time_counter
+        if self._edge_vehs_counter != counter:
+            self._edge_vehs = {}
+            self._edge_vehs_counter = counter
+        if isinstance(edges, (list, np.ndarray)):
+            return sum([self._get_ids_by_edge(edge) for edge in edges], [])
+        if edges not in self._edge_vehs:
+            self._edge_vehs[edges] = self.k.vehicle.get_ids_by_edge(edges)
+        return self._edge_vehs[edges]
+
+    def _gather_raw(self, rl_ids):
+        """Collect the speeds and headways observed by each RL vehicle.
+
+        The data of all RL vehicles and of their leaders and followers is
+        fetched with one batched kernel query per attribute, instead of
+        several queries per RL vehicle, and returned as one array per
+        attribute. The leader and headway of each RL vehicle are also stored
+        in self._last_obs_cache for use by compute_reward.
+
+        Parameters
+        ----------
+        rl_ids : list of str
+            ids of the RL vehicles to collect data for
+
+        Returns
+        -------
+        dict
+            "ids" and "lead_ids" map to lists of vehicle ids, while
+            "this_speed", "lead_speed", "lead_head", "follow_speed" and
+            "follow_head" map to arrays aligned with "ids". If the leader
+            (follower) is not visible, its speed and headway are replaced by
+            default values.
+        """
+        # normalizing constants, used as defaults for missing vehicles
+        max_speed = self._max_speed
+        max_length = self._max_length
+
+        rl_ids = list(rl_ids)
+        lead_ids = self.k.vehicle.get_leader(rl_ids)
+        followers = self.k.vehicle.get_follower(rl_ids)
+
+        has_lead = np.array(
+            [veh_id not in ("", None) for veh_id in lead_ids], dtype=bool)
+        has_follow = np.array(
+            [veh_id not in ("", None) for veh_id in followers], dtype=bool)
+        visible_leaders = [
+            veh_id for veh_id, h in zip(lead_ids, has_lead) if h]
+        visible_followers = [
+            veh_id for veh_id, h in zip(followers, has_follow) if h]
+
+        this_speed = np.array(
+            self.k.vehicle.get_speed(rl_ids), dtype=np.float32)
+        lead_head = np.array(
+            self.k.vehicle.get_headway(rl_ids), dtype=np.float32)
+
+        # in case leader is not visible
+        lead_speed = np.full(len(rl_ids), max_speed, dtype=np.float32)
+        lead_speed[has_lead] = self.k.vehicle.get_speed(visible_leaders)
+
+        # in case follower is not visible
+        follow_speed = np.zeros(len(rl_ids), dtype=np.float32)
+        follow_speed[has_follow] = self.k.vehicle.get_speed(visible_followers)
+        follow_head = np.full(len(rl_ids), max_length, dtype=np.float32)
+        follow_head[has_follow] = \
+            self.k.vehicle.get_headway(visible_followers)
+
+        self._last_obs_cache = (self.k.vehicle.time_counter,
+                                dict(zip(rl_ids, zip(lead_ids, lead_head))))
+
+        return {
+            "ids": rl_ids,
+            "lead_ids": lead_ids,
+            "this_speed": this_speed,
+            "lead_speed": lead_speed,
+            "lead_head": np.where(has_lead, lead_head, max_length),
+            "follow_speed": follow_speed,
+            "follow_head": follow_head,
+        }
+
+    def _get_lead_data(self, rl_id):
+        """Return the speed, leader and headway of an RL vehicle.
+
+        The leader and headway stored by the last call to get_state are
+        reused if the vehicle kernel has not been updated since, instead of
+        querying the kernel a second time. The speed is always read from the
+        kernel.
+        """
+        speed = self.k.vehicle.get_speed(rl_id)
+        cache = self._last_obs_cache
+        if cache is not None and cache[0] == self.k.vehicle.time_counter \
+                and rl_id in cache[1]:
+            return (speed,) + cache[1][rl_id]
+        return (speed,
+                self.k.vehicle.get_leader(rl_id),
+                self.k.vehicle.get_headway(rl_id))
+
+    def _build_base_obs(self, raw, num_cols=5):
+        """Build the observation matrix of the vehicles returned by _gather_raw.
+
+        Parameters
+        ----------
+        raw : dict
+            output of _gather_raw
+        num_cols : int
+            number of columns of the matrix. The first five are filled with
+            the normalized speeds and headways, the others are left to the
+            caller.
+
+        Returns
+        -------
+        np.ndarray
+            float32 matrix with one row per vehicle in raw["ids"]
+        """
+        obs_matrix = np.empty((len(raw["ids"]), num_cols), dtype=np.float32)
+        _fill_base_obs(raw["this_speed"], raw["lead_speed"], raw["lead_head"],
+                       raw["follow_speed"], raw["follow_head"],
+                       self._max_speed, self._max_length, obs_matrix)
+        return obs_matrix
 
-        for rl_id in self.k.vehicle.get_rl_ids():
-            this_speed = self.k.vehicle.get_speed(rl_id)
-            lead_id = self.k.vehicle.get_leader(rl_id)
-            follower = self.k.vehicle.get_follower(rl_id)
+    def get_state(self):
+        """See class definition."""
+        raw = self._gather_raw(self._get_rl_ids())
+        obs_matrix = self._build_base_obs(raw)
 
-            if lead_id in ["", None]:
-                # in case leader is not visible
-                lead_speed = max_speed
-                lead_head = max_length
-            else:
-                lead_speed = self.k.vehicle.get_speed(lead_id)
-                lead_head = self.k.vehicle.get_headway(rl_id)
+        # each observation is a row view of the same matrix
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(raw["ids"])}
 
-            if follower in ["", None]:
-                # in case follower is not visible
-                follow_speed = 0
-                follow_head = max_length
-            else:
-                follow_speed = self.k.vehicle.get_speed(follower)
-                follow_head = self.k.vehicle.get_headway(follower)
-            
-            observation = np.array([
-                this_speed / max_speed,
-                (lead_speed - this_speed) / max_speed,
-                lead_head / max_length,
-                (this_speed - follow_speed) / max_speed,
-                follow_head / max_length
-            ])
-            '''
-            observation = np.array([
-                this_speed / max_speed,
-                lead_speed / max_speed,
-                lead_head / max_length,
-                follow_speed / max_speed,
-                follow_head / max_length
-            ])
-            '''
-
-            obs.update({rl_id: observation})
-
-        return obs
-    
     def compute_reward(self, rl_actions, **kwargs):
         """See class definition."""
         # in the warmup steps
@@ -155,7 +323,8 @@ class MultiAgentHighwayPOEnv(MultiEnv):
             return {}
 
         rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
+        cost1 = None
+        for rl_id in self._get_rl_ids():
             if self.env_params.evaluate:
                 # reward is speed of vehicle if we are in evaluation mode
                 reward = self.k.vehicle.get_speed(rl_id)
@@ -163,20 +332,21 @@ class MultiAgentHighwayPOEnv(MultiEnv):
                 # reward is 0 if a collision occurred
                 reward = 0
             else:
-                # reward high system-level velocities
-                cost1 = desired_velocity(self, fail=kwargs['fail'])
+                # reward high system-level velocities (same for all agents)
+                if cost1 is None:
+                    cost1 = desired_velocity(self, fail=kwargs['fail'])
 
-                # penalize small time headways
+                # penalize time headways smaller than 1 s, in [-1, 0]
                 cost2 = 0
-                t_min = 1  # smallest acceptable time headway
 
-                lead_id = self.k.vehicle.get_leader(rl_id)
-                if lead_id not in ["", None] \
-                        and self.k.vehicle.get_speed(rl_id) > 0:
-                    t_headway = max(
-                        self.k.vehicle.get_headway(rl_id) /
-                        self.k.vehicle.get_speed(rl_id), 0)
-                    cost2 += min((t_headway - t_min) / t_min, 0)
+                speed, lead_id, headway = self._get_lead_data(rl_id)
+                if lead_id not in ("", None) and speed > 0:
+                    cost2 = headway / speed - 1.0
+                    if cost2 > 0:
+                        cost2 = 0.0
+                    elif cost2 < -1.0:
+                        # negative headways (overlapping vehicles)
+                        cost2 = -1.0
 
                 # weights for cost1, cost2, and cost3, respectively
                 eta1, eta2 = 1.00, 0.00
@@ -192,7 +362,7 @@ class MultiAgentHighwayPOEnv(MultiEnv):
         Define which vehicles are observed for visualization purposes.
         """
         # specify observed vehicles
-        for rl_id in self.k.vehicle.get_rl_ids():
+        for rl_id in self._get_rl_ids():
             # leader
             lead_id = self.k.vehicle.get_leader(rl_id)
             if lead_id:
@@ -202,6 +372,15 @@ class MultiAgentHighwayPOEnv(MultiEnv):
             if follow_id:
                 self.k.vehicle.set_observed(follow_id)
 
+    def reset(self, new_inflow_rate=None):
+        """See parent class."""
+        # drop the data of the previous rollout's vehicles
+        self._last_obs_cache = None
+        self._step_rl_ids = None
+        self._edge_vehs = {}
+        self._edge_vehs_counter = None
+        return super().reset(new_inflow_rate)
+
 class MultiAgentHighwayPOEnvWindow(MultiAgentHighwayPOEnv):
     def __init__(self, env_params, sim_params, network, simulator='traci'):
         for p in ADDITIONAL_ENV_PARAMS.keys():
@@ -295,13 +474,15 @@ class MultiAgentHighwayPOEnvWindow(MultiAgentHighwayPOEnv):
         for rl_id in self.exiting_rl_veh: #self.k.vehicle.get_arrived_rl_ids():
             done[rl_id] = True
             reward[rl_id] = 20 #1 #0
-            states[rl_id] = np.zeros(self.observation_space.shape[0])
+            states[rl_id] = np.zeros(
+                self.observation_space.shape[0], dtype=np.float32)
             #print("rl_id",rl_id, states)
         for rl_id in self.k.vehicle.get_arrived_rl_ids():
             #print("arrived:",rl_id)
             done[rl_id] = True
             reward[rl_id] = 20
-            states[rl_id] = np.zeros(self.observation_space.shape[0])
+            states[rl_id] = np.zeros(
+                self.observation_space.shape[0], dtype=np.float32)
 
         return states, reward, done, infos
     
@@ -309,65 +490,20 @@ class MultiAgentHighwayPOEnvWindow(MultiAgentHighwayPOEnv):
         """See class definition."""
         # in the warmup steps, rl_actions is None
         if rl_actions:
-            for rl_id, actions in rl_actions.items():
-                accel = actions[0]
-                if rl_id not in self.rl_veh:
-                    continue
-                # lane_change_softmax = np.exp(actions[1:4])
-                # lane_change_softmax /= np.sum(lane_change_softmax)
-                # lane_change_action = np.random.choice([-1, 0, 1],
-                #                                       p=lane_change_softmax)
-                self.k.vehicle.apply_acceleration(rl_id, accel)
-                # self.k.vehicle.apply_lane_change(rl_id, lane_change_action)
+            rl_ids = [rl_id for rl_id in rl_actions if rl_id in self.rl_veh]
+            accels = [rl_actions[rl_id][0] for rl_id in rl_ids]
+            # lane_change_softmax = np.exp(actions[1:4])
+            # lane_change_softmax /= np.sum(lane_change_softmax)
+            # lane_change_action = np.random.choice([-1, 0, 1],
+            #                                       p=lane_change_softmax)
+            self.k.vehicle.apply_acceleration(rl_ids, accels)
+            # self.k.vehicle.apply_lane_change(rl_id, lane_change_action)
     def get_state(self):
         """See class definition."""
-        obs = {}
-
-        # normalizing constants
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
-
-        for rl_id in self.rl_veh:
-            this_speed = self.k.vehicle.get_speed(rl_id)
-            lead_id = self.k.vehicle.get_leader(rl_id)
-            follower = self.k.vehicle.get_follower(rl_id)
-
-            if lead_id in ["", None]:
-                # in case leader is not visible
-                lead_speed = max_speed
-                lead_head = max_length
-            else:
-                lead_speed = self.k.vehicle.get_speed(lead_id)
-                lead_head = self.k.vehicle.get_headway(rl_id)
+        raw = self._gather_raw(self.rl_veh)
+        obs_matrix = self._build_base_obs(raw)
 
-            if follower in ["", None]:
-                # in case follower is not visible
-                follow_speed = 0
-                follow_head = max_length
-            else:
-                follow_speed = self.k.vehicle.get_speed(follower)
-                follow_head = self.k.vehicle.get_headway(follower)
-            
-            observation = np.array([
-                this_speed / max_speed,
-                (lead_speed - this_speed) / max_speed,
-                lead_head / max_length,
-                (this_speed - follow_speed) / max_speed,
-                follow_head / max_length
-            ])
-            '''
-            observation = np.array([
-                this_speed / max_speed,
-                lead_speed / max_speed,
-                lead_head / max_length,
-                follow_speed / max_speed,
-                follow_head / max_length
-            ])
-            '''
-
-            obs.update({rl_id: observation})
-
-        return obs
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(raw["ids"])}
 
     def additional_command(self):
         """See parent class.
@@ -377,7 +513,7 @@ class MultiAgentHighwayPOEnvWindow(MultiAgentHighwayPOEnv):
         if 'ignore_edges' not in self.env_params.additional_params:
                 super().additional_command()
         else:
-                rl_ids = self.k.vehicle.get_rl_ids()
+                rl_ids = self._get_rl_ids()
                 self.exiting_rl_veh = []
                 # add rl vehicles that just entered the network into the rl queue
                 for veh_id in rl_ids:
@@ -430,7 +566,6 @@ class MultiAgentHighwayPOEnvWindowCollaborate(MultiAgentHighwayPOEnvWindow):
         if rl_actions is None:
             return {}
 
-        rewards = {}
         eta1 = 0.9
         eta2 = 0.1
         reward1 = -0.1
@@ -440,16 +575,14 @@ class MultiAgentHighwayPOEnvWindowCollaborate(MultiAgentHighwayPOEnvWindow):
             edge = self.k.vehicle.get_edge(veh_id)
             if edge not in edges:
                 edges.append(edge)
-        interested_vehs = self.k.vehicle.get_ids_by_edge(edges)
+        interested_vehs = self._get_ids_by_edge(edges)
         if len(interested_vehs) >0:
             reward2 = np.mean(self.k.vehicle.get_speed(interested_vehs))/300
         else:
             reward2 = 0
 
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.rl_veh:
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(self.rl_veh, reward)
 
 class MultiAgentHighwayPOEnvAvgVel(MultiAgentHighwayPOEnv):
   
@@ -460,7 +593,8 @@ class MultiAgentHighwayPOEnvAvgVel(MultiAgentHighwayPOEnv):
             return {}
 
         rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
+        cost1 = None
+        for rl_id in self._get_rl_ids():
             if self.env_params.evaluate:
                 # reward is speed of vehicle if we are in evaluation mode
                 reward = self.k.vehicle.get_speed(rl_id)
@@ -468,20 +602,21 @@ class MultiAgentHighwayPOEnvAvgVel(MultiAgentHighwayPOEnv):
                 # reward is 0 if a collision occurred
                 reward = 0
             else:
-                # reward high system-level velocities
-                cost1 = desired_velocity(self, fail=kwargs['fail'])
+                # reward high system-level velocities (same for all agents)
+                if cost1 is None:
+                    cost1 = desired_velocity(self, fail=kwargs['fail'])
 
-                # penalize small time headways
+                # penalize time headways smaller than 1 s, in [-1, 0]
                 cost2 = 0
-                t_min = 1  # smallest acceptable time headway
 
-                lead_id = self.k.vehicle.get_leader(rl_id)
-                if lead_id not in ["", None] \
-                        and self.k.vehicle.get_speed(rl_id) > 0:
-                    t_headway = max(
-                        self.k.vehicle.get_headway(rl_id) /
-                        self.k.vehicle.get_speed(rl_id), 0)
-                    cost2 += min((t_headway - t_min) / t_min, 0)
+                speed, lead_id, headway = self._get_lead_data(rl_id)
+                if lead_id not in ("", None) and speed > 0:
+                    cost2 = headway / speed - 1.0
+                    if cost2 > 0:
+                        cost2 = 0.0
+                    elif cost2 < -1.0:
+                        # negative headways (overlapping vehicles)
+                        cost2 = -1.0
 
                 # weights for cost1, cost2, and cost3, respectively
                 eta1, eta2 = 1.00, 0.00
@@ -497,7 +632,7 @@ class MultiAgentHighwayPOEnvAvgVel(MultiAgentHighwayPOEnv):
         Define which vehicles are observed for visualization purposes.
         """
         # specify observed vehicles
-        for rl_id in self.k.vehicle.get_rl_ids():
+        for rl_id in self._get_rl_ids():
             # leader
             lead_id = self.k.vehicle.get_leader(rl_id)
             if lead_id:
@@ -509,15 +644,34 @@ class MultiAgentHighwayPOEnvAvgVel(MultiAgentHighwayPOEnv):
 
 
 class MultiAgentHighwayPOEnvLocalReward(MultiAgentHighwayPOEnv):
+    def __init__(self, env_params, sim_params, network, simulator='traci'):
+        super().__init__(env_params, sim_params, network, simulator)
+
+        # (edge, lane) -> lanes leading into it. The topology of the network
+        # does not change, so it is computed once for every edge and junction
+        net = self.k.network
+        self._prev_adj = {
+            (edge, lane): list(net.prev_edge(edge, lane))
+            for edge in net.get_edge_list() + net.get_junction_list()
+            for lane in range(net.num_lanes(edge))
+        }
+
     def _veh_edge_lane(self, edge, lane):
-        return [veh for veh in self.k.vehicle.get_ids_by_edge(edge) if self.k.vehicle.get_lane(veh) == lane]
+        edge_veh = self._get_ids_by_edge(edge)
+        lanes = self.k.vehicle.get_lane(edge_veh)
+        return [veh for veh, veh_lane in zip(edge_veh, lanes) if veh_lane == lane]
 
     def _veh_edge_lane_backward_pass(self, edge, lane, junctions):
+        # walk back through the junctions with an explicit stack, collecting
+        # the vehicles of every lane leading into (edge, lane)
         veh = []
-        for prev_edge, prev_lane in self.k.network.prev_edge(edge, lane):
-            if prev_edge in junctions:
-                veh += self._veh_edge_lane_backward_pass(prev_edge, prev_lane, junctions)
-            veh += self._veh_edge_lane(prev_edge, prev_lane)
+        stack = [(edge, lane)]
+        while stack:
+            edge, lane = stack.pop()
+            for prev_edge, prev_lane in self._prev_adj.get((edge, lane), []):
+                if prev_edge in junctions:
+                    stack.append((prev_edge, prev_lane))
+                veh.extend(self._veh_edge_lane(prev_edge, prev_lane))
         return veh
 
     def _compute_avgspeed_agent(self, rl_id, **kwargs):
@@ -525,23 +679,19 @@ class MultiAgentHighwayPOEnvLocalReward(MultiAgentHighwayPOEnv):
             return 0 
         edge = self.k.vehicle.get_edge(rl_id)
         lane = self.k.vehicle.get_lane(rl_id)
-        pos = self.k.vehicle.get_position(edge)
-        edge_veh = self.k.vehicle.get_ids_by_edge(edge)
-        junctions = set(self.k.network.get_junction_list())
-        neighbours = []
-        for veh in edge_veh:
-            veh_lane = self.k.vehicle.get_lane(veh)
-            veh_pos = self.k.vehicle.get_position(veh)
-            if veh_lane == lane and veh_pos <= pos:
-                neighbours.append(veh)
-        neighbours += self._veh_edge_lane_backward_pass(edge, lane, junctions)
-        neighbours = np.array(neighbours)
-        if len(neighbours) == 0:
+        pos = self.k.vehicle.get_position(edge)  # FIXME should be rl_id
+        edge_veh = self._get_ids_by_edge(edge)
+        # vehicles behind the RL vehicle on its lane, selected in one pass
+        lanes = np.array(self.k.vehicle.get_lane(edge_veh))
+        positions = np.array(self.k.vehicle.get_position(edge_veh))
+        mask = (lanes == lane) & (positions <= pos)
+        neighbours = [veh for veh, keep in zip(edge_veh, mask) if keep]
+        neighbours += self._veh_edge_lane_backward_pass(
+            edge, lane, self._junctions)
+        if not neighbours:
             return 0
-        vel = np.array(self.k.vehicle.get_speed(neighbours))
-        if any(vel<-100):
-            return 0
-        return np.sum(vel)/len(vel)
+        vel = np.asarray(self.k.vehicle.get_speed(neighbours), dtype=float)
+        return _mean_speed(vel)
 
     def _compute_avgspeednormalized_agent(self, rl_id, **kwargs):
         reward = self._compute_avgspeed_agent(rl_id, **kwargs)
@@ -551,77 +701,51 @@ class MultiAgentHighwayPOEnvLocalReward(MultiAgentHighwayPOEnv):
         if rl_actions is None:
             return {}
         rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
+        for rl_id in self._get_rl_ids():
             rewards[rl_id] = self._compute_avgspeednormalized_agent(rl_id, **kwargs)
         return rewards
 
 
 class MultiAgentHighwayPOEnvDistanceMergeInfo(MultiAgentHighwayPOEnv):
+    def __init__(self, env_params, sim_params, network, simulator='traci'):
+        super().__init__(env_params, sim_params, network, simulator)
+
+        # merge geometry, fetched once instead of at every step
+        self._len_bottom = self.k.network.edge_length("bottom")
+
+        self._edge_dist_table = _center_dist_table(self.k.network)
+
     @property
     def observation_space(self):
         return Box(low=-1, high=1, shape=(7, ), dtype=np.float32)
 
     def get_state(self):
         """See class definition."""
-        obs = {}
-
-        # normalizing constants
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
-        merge_vehs = self.k.vehicle.get_ids_by_edge("bottom")
-        merge_dists = [self.k.vehicle.get_position(veh) for veh in merge_vehs]
+        merge_vehs = self._get_ids_by_edge("bottom")
         merge_distance = 1
-        len_bottom = self.k.network.edge_length("bottom")
-        position = self.k.network.total_edgestarts_dict["bottom"]
-        if len(merge_dists)>0:
-            position = max(merge_dists)
+        len_bottom = self._len_bottom
+        if len(merge_vehs)>0:
+            # position of the merging vehicle closest to the junction
+            position = np.max(np.asarray(
+                self.k.vehicle.get_position(merge_vehs), dtype=np.float32))
             merge_distance = (len_bottom - position)/len_bottom
 
-        for rl_id in self.k.vehicle.get_rl_ids():
-            this_speed = self.k.vehicle.get_speed(rl_id)
-            lead_id = self.k.vehicle.get_leader(rl_id)
-            follower = self.k.vehicle.get_follower(rl_id)
-
-            if lead_id in ["", None]:
-                # in case leader is not visible
-                lead_speed = max_speed
-                lead_head = max_length
-            else:
-                lead_speed = self.k.vehicle.get_speed(lead_id)
-                lead_head = self.k.vehicle.get_headway(rl_id)
-
-            if follower in ["", None]:
-                # in case follower is not visible
-                follow_speed = 0
-                follow_head = max_length
-            else:
-                follow_speed = self.k.vehicle.get_speed(follower)
-                follow_head = self.k.vehicle.get_headway(follower)
-            
-            veh_x = self.k.vehicle.get_x_by_id(rl_id)
-            edge = self.k.vehicle.get_edge(rl_id)
-            length = self.k.network.edge_length(edge)
-            center_x = self.k.network.total_edgestarts_dict["center"]
-            distance = 1
-            if edge in ["inflow_highway","left","center"]:
-                distance = (veh_x - center_x)/(center_x)
-            else:
-                pass #FIXME implement
-
-            observation = np.array([
-                this_speed / max_speed,
-                (lead_speed - this_speed) / max_speed,
-                lead_head / max_length,
-                (this_speed - follow_speed) / max_speed,
-                follow_head / max_length,
-                np.clip(distance,-1,1),
-                np.clip(merge_distance,-1,1),
+        raw = self._gather_raw(self._get_rl_ids())
+        rl_edges = self.k.vehicle.get_edge(raw["ids"])
 
-            ])
+        # the distance stays 1 on edges missing from the table
+        distance = np.ones(len(raw["ids"]), dtype=np.float32)
+        for i, (rl_id, edge) in enumerate(zip(raw["ids"], rl_edges)):
+            params = self._edge_dist_table.get(edge)
+            if params is not None:
+                origin, scale = params
+                veh_x = self.k.vehicle.get_x_by_id(rl_id)
+                distance[i] = (veh_x - origin)/scale
 
-            obs.update({rl_id: observation})
+        obs_matrix = self._build_base_obs(raw, num_cols=7)
+        _fill_merge_obs(distance, float(merge_distance), obs_matrix)
 
-        return obs
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(raw["ids"])}
 
 class MultiAgentHighwayPOEnvNewStates(MultiAgentHighwayPOEnv):
     @property
@@ -632,7 +756,7 @@ class MultiAgentHighwayPOEnvNewStates(MultiAgentHighwayPOEnv):
     def _closest_vehicle(self, edge, lane, base_edge):
         if edge == base_edge: return float('inf'), 0
         if edge == '': return float('inf'), 0
-        veh = self.k.vehicle.get_ids_by_edge(edge)
+        veh = self._get_ids_by_edge(edge)
         if len(veh) == 0:
             veh_pos = 0
             veh_id = None
@@ -662,18 +786,19 @@ class MultiAgentHighwayPOEnvNewStates(MultiAgentHighwayPOEnv):
             return float('inf'), 0
 
     def get_state(self):
-        states = super().get_state()
-        junctions = set(self.k.network.get_junction_list())
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
-        for rl_id in states:
+        raw = self._gather_raw(self._get_rl_ids())
+        obs_matrix = self._build_base_obs(raw, num_cols=9)
+        junctions = self._junctions
+        max_speed = self._max_speed
+        max_length = self._max_length
+        for i, rl_id in enumerate(raw["ids"]):
             edge_id = self.k.vehicle.get_edge(rl_id)
             lane = self.k.vehicle.get_lane(rl_id)
             edge_len = self.k.network.edge_length(edge_id)
             rl_position = self.k.vehicle.get_position(rl_id)
             rl_dist = max(edge_len-rl_position, 0) / max_length
             veh_vel = []
-            for veh_id in self.k.vehicle.get_ids_by_edge(edge_id):
+            for veh_id in self._get_ids_by_edge(edge_id):
                 veh_position = self.k.vehicle.get_position(veh_id)
                 if veh_position > rl_position:
                     veh_vel.append(self.k.vehicle.get_speed(veh_id))
@@ -687,9 +812,10 @@ class MultiAgentHighwayPOEnvNewStates(MultiAgentHighwayPOEnv):
             merge_vel /= max_speed
             if merge_dist == float('inf'):
                 merge_dist = 1
-            states[rl_id] = np.array(list(states[rl_id]) + [rl_dist, veh_vel, merge_dist, merge_vel])
-        #print(states)
-        return states
+            obs_matrix[i, 5:] = (rl_dist, veh_vel, merge_dist, merge_vel)
+
+        # each observation is a row view of the same matrix
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(raw["ids"])}
 
 class MultiAgentHighwayPOEnvNewStatesNegative(MultiAgentHighwayPOEnvNewStates):
     def compute_reward(self, rl_actions, **kwargs):
@@ -697,7 +823,7 @@ class MultiAgentHighwayPOEnvNewStatesNegative(MultiAgentHighwayPOEnvNewStates):
             return {}
 
         rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
+        for rl_id in self._get_rl_ids():
             self_speed = self.k.vehicle.get_speed(rl_id)
             reward = -0.1
             #prevent RL stop
@@ -711,37 +837,33 @@ class MultiAgentHighwayPOEnvNewStatesZero(MultiAgentHighwayPOEnvNewStates):
         if rl_actions is None:
             return {}
 
-        rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = 0
-        return rewards
+        return dict.fromkeys(self._get_rl_ids(), 0)
 
 class MultiAgentHighwayPOEnvNewStatesNegativeInflow(MultiAgentHighwayPOEnvNewStates):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
         inflow_reward = self.k.vehicle._num_departed[-1]*0.1
         alpha = 0.5
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = -0.1 + inflow_reward
-        return rewards
+        return dict.fromkeys(
+            self._get_rl_ids(), -0.1 + inflow_reward)
 
 class MultiAgentHighwayPOEnvNewStatesCollaborate(MultiAgentHighwayPOEnvNewStates):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         eta1 = 0.9
         eta2 = 0.1
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 
 
@@ -750,37 +872,30 @@ class MultiAgentHighwayPOEnvDistanceMergeInfoNegative(MultiAgentHighwayPOEnvDist
         if rl_actions is None:
             return {}
 
-        rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
-            reward = -0.1
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(self._get_rl_ids(), -0.1)
 
 class MultiAgentHighwayPOEnvDistanceMergeInfoCollaborate(MultiAgentHighwayPOEnvDistanceMergeInfo):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         eta1 = 0.5
         eta2 = 0.5
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
                    
 class MultiAgentHighwayPOEnvNegative(MultiAgentHighwayPOEnv):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids(): 
-            reward = -0.1
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(self._get_rl_ids(), -0.1)
 
 
 class MultiAgentHighwayPOEnvCollaborate(MultiAgentHighwayPOEnv):
@@ -788,7 +903,10 @@ class MultiAgentHighwayPOEnvCollaborate(MultiAgentHighwayPOEnv):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -798,11 +916,19 @@ class MultiAgentHighwayPOEnvCollaborate(MultiAgentHighwayPOEnv):
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
+    def __init__(self, env_params, sim_params, network, simulator='traci'):
+        super().__init__(env_params, sim_params, network, simulator)
+
+        # merge geometry, fetched once instead of at every step
+        self._len_merge = self.k.network.edge_length("bottom") + \
+            self.k.network.edge_length("inflow_merge")
+        self._merge_start = \
+            self.k.network.total_edgestarts_dict["inflow_merge"]
+        self._edge_dist_table = _center_dist_table(self.k.network)
+
     @property
     def observation_space(self):
         #See class definition
@@ -811,7 +937,7 @@ class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
     def _closest_vehicle(self, edge, lane, base_edge):
         if edge == base_edge: return float('inf'), 0
         if edge == '': return float('inf'), 0
-        veh = self.k.vehicle.get_ids_by_edge(edge)
+        veh = self._get_ids_by_edge(edge)
         if len(veh) == 0:
             veh_pos = 0
             veh_id = None
@@ -840,20 +966,24 @@ class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
         except ValueError:
             return float('inf'), 0
 
-    def get_state(self):
-        states = super().get_state()
-        junctions = set(self.k.network.get_junction_list())
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
+    def _get_state_matrix(self):
+        """Return the ids of the RL vehicles and their observation matrix.
+
+        Row i of the float32 matrix holds the nine observations of the i-th
+        RL vehicle. The ablation environments drop some of its columns.
+        """
+        raw = self._gather_raw(self._get_rl_ids())
+        obs_matrix = self._build_base_obs(raw, num_cols=9)
+        junctions = self._junctions
 
         # normalizing constants
-        max_speed = self.k.network.max_speed()
-        max_length = self.k.network.length()
-        merge_vehs = self.k.vehicle.get_ids_by_edge(["bottom","inflow_merge"])
+        max_speed = self._max_speed
+        max_length = self._max_length
+        merge_vehs = self._get_ids_by_edge(["bottom","inflow_merge"])
         #merge_dists = [self.k.vehicle.get_x(veh) for veh in merge_vehs]
         merge_distance = 1
-        len_merge = self.k.network.edge_length("bottom") + self.k.network.edge_length("inflow_merge")
-        start_position = self.k.network.total_edgestarts_dict["inflow_merge"]
+        len_merge = self._len_merge
+        start_position = self._merge_start
         merge_vel = 0
         if len(merge_vehs)>0:
             for veh in merge_vehs:
@@ -863,10 +993,14 @@ class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
                     merge_vel = self.k.vehicle.get_speed(veh)/max_speed
                 
         
-        for rl_id in states:
+        # vehicles on the highway before the merge, seen by all RL vehicles
+        highway_vehs = self._get_ids_by_edge(["left","inflow_highway"])
+        highway_x = [self.k.vehicle.get_x_by_id(veh_id)
+                     for veh_id in highway_vehs]
+
+        for i, rl_id in enumerate(raw["ids"]):
             edge_id = self.k.vehicle.get_edge(rl_id)
             lane = self.k.vehicle.get_lane(rl_id)
-            edge_len = self.k.network.edge_length(edge_id)
             rl_position = self.k.vehicle.get_position(rl_id)
             rl_x = self.k.vehicle.get_x_by_id(rl_id)
             #rl_dist = max(edge_len-rl_position, 0) / max_length
@@ -875,16 +1009,13 @@ class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
             #calculate RL distance to the center junction
             veh_x = self.k.vehicle.get_x_by_id(rl_id)
             edge = self.k.vehicle.get_edge(rl_id)
-            length = self.k.network.edge_length(edge)
-            center_x = self.k.network.total_edgestarts_dict["center"]
             rl_dist = 1
-            if edge in ["inflow_highway","left","center"]:
-                rl_dist = (veh_x - center_x)/(center_x)
-            else:
-                pass #FIXME: not yet implemented
+            params = self._edge_dist_table.get(edge)
+            if params is not None:
+                origin, scale = params
+                rl_dist = (veh_x - origin)/scale
             num_veh_ahead = 0 
-            for veh_id in self.k.vehicle.get_ids_by_edge(["left","inflow_highway"]):
-                veh_position = self.k.vehicle.get_x_by_id(veh_id)
+            for veh_id, veh_position in zip(highway_vehs, highway_x):
                 if veh_position > rl_x:
                     veh_vel.append(self.k.vehicle.get_speed(veh_id))
                     num_veh_ahead += 1
@@ -895,30 +1026,33 @@ class MultiAgentHighwayPOEnvMerge4(MultiAgentHighwayPOEnv):
             veh_vel /= max_speed
             
             if edge in ["center"]:
-                states[rl_id] = np.array(list(states[rl_id]) + [rl_dist, veh_vel, 1.0, 0.0])
+                obs_matrix[i, 5:] = (rl_dist, veh_vel, 1.0, 0.0)
             else:
-                states[rl_id] = np.array(list(states[rl_id]) + [rl_dist, veh_vel, merge_distance, merge_vel])
-        #print(states)
-        return states
+                obs_matrix[i, 5:] = (rl_dist, veh_vel, merge_distance, merge_vel)
+        return raw["ids"], obs_matrix
+
+    def get_state(self):
+        rl_ids, obs_matrix = self._get_state_matrix()
+
+        # each observation is a row view of the same matrix
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvMerge4Negative(MultiAgentHighwayPOEnvMerge4):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
-            self_speed = self.k.vehicle.get_speed(rl_id)
-            reward = -0.1
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(self._get_rl_ids(), -0.1)
 
 class MultiAgentHighwayPOEnvMerge4Collaborate(MultiAgentHighwayPOEnvMerge4):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -928,9 +1062,7 @@ class MultiAgentHighwayPOEnvMerge4Collaborate(MultiAgentHighwayPOEnvMerge4):
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvAblationDistance(MultiAgentHighwayPOEnvMerge4):
     @property
@@ -939,20 +1071,19 @@ class MultiAgentHighwayPOEnvAblationDistance(MultiAgentHighwayPOEnvMerge4):
         return Box(-float('inf'), float('inf'), shape=(8,), dtype=np.float32)
 
     def get_state(self):
-        states = super().get_state()
-        for rl_id in states:
-            edge = self.k.vehicle.get_edge(rl_id)
-            state_rl_id = list(states[rl_id])
-            state_rl_id.pop(5)
-            states[rl_id] = state_rl_id
-        return states
+        rl_ids, obs_matrix = self._get_state_matrix()
+        obs_matrix = np.delete(obs_matrix, [5], axis=1)
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvAblationDistanceCollaborate(MultiAgentHighwayPOEnvAblationDistance):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -962,9 +1093,7 @@ class MultiAgentHighwayPOEnvAblationDistanceCollaborate(MultiAgentHighwayPOEnvAb
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvAblationConjestion(MultiAgentHighwayPOEnvMerge4):
     @property
@@ -973,20 +1102,19 @@ class MultiAgentHighwayPOEnvAblationConjestion(MultiAgentHighwayPOEnvMerge4):
         return Box(-float('inf'), float('inf'), shape=(8,), dtype=np.float32)
 
     def get_state(self):
-        states = super().get_state()
-        for rl_id in states:
-            edge = self.k.vehicle.get_edge(rl_id)
-            state_rl_id = list(states[rl_id])
-            state_rl_id.pop(6)
-            states[rl_id] = state_rl_id
-        return states
+        rl_ids, obs_matrix = self._get_state_matrix()
+        obs_matrix = np.delete(obs_matrix, [6], axis=1)
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvAblationConjestionCollaborate(MultiAgentHighwayPOEnvAblationConjestion):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -996,9 +1124,7 @@ class MultiAgentHighwayPOEnvAblationConjestionCollaborate(MultiAgentHighwayPOEnv
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvAblationConjestionDistance(MultiAgentHighwayPOEnvMerge4):
     @property
@@ -1007,21 +1133,19 @@ class MultiAgentHighwayPOEnvAblationConjestionDistance(MultiAgentHighwayPOEnvMer
         return Box(-float('inf'), float('inf'), shape=(7,), dtype=np.float32)
 
     def get_state(self):
-        states = super().get_state()
-        for rl_id in states:
-            edge = self.k.vehicle.get_edge(rl_id)
-            state_rl_id = list(states[rl_id])
-            state_rl_id.pop(6)
-            state_rl_id.pop(5)
-            states[rl_id] = state_rl_id
-        return states
+        rl_ids, obs_matrix = self._get_state_matrix()
+        obs_matrix = np.delete(obs_matrix, [5, 6], axis=1)
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvAblationConjestionDistanceCollaborate(MultiAgentHighwayPOEnvAblationConjestionDistance):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -1031,9 +1155,7 @@ class MultiAgentHighwayPOEnvAblationConjestionDistanceCollaborate(MultiAgentHigh
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvAblationConjestionMergeInfo(MultiAgentHighwayPOEnvMerge4):
     @property
@@ -1042,22 +1164,19 @@ class MultiAgentHighwayPOEnvAblationConjestionMergeInfo(MultiAgentHighwayPOEnvMe
         return Box(-float('inf'), float('inf'), shape=(6,), dtype=np.float32)
 
     def get_state(self):
-        states = super().get_state()
-        for rl_id in states:
-            edge = self.k.vehicle.get_edge(rl_id)
-            state_rl_id = list(states[rl_id])
-            state_rl_id.pop(-1)
-            state_rl_id.pop(-1)
-            state_rl_id.pop(6)
-            states[rl_id] = state_rl_id
-        return states
+        rl_ids, obs_matrix = self._get_state_matrix()
+        obs_matrix = np.delete(obs_matrix, [6, 7, 8], axis=1)
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvAblationConjestionMergeInfoCollaborate(MultiAgentHighwayPOEnvAblationConjestionMergeInfo):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -1067,9 +1186,7 @@ class MultiAgentHighwayPOEnvAblationConjestionMergeInfoCollaborate(MultiAgentHig
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
 class MultiAgentHighwayPOEnvAblationConjestionArrive(MultiAgentHighwayPOEnvAblationConjestion):
     def compute_reward(self, rl_actions, **kwargs):
@@ -1080,10 +1197,7 @@ class MultiAgentHighwayPOEnvAblationConjestionArrive(MultiAgentHighwayPOEnvAblat
         else:
             reward = 0
 
-        rewards = {}
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(self._get_rl_ids(), reward)
 
 class MultiAgentHighwayPOEnvAblationMergeInfo(MultiAgentHighwayPOEnvMerge4):
     @property
@@ -1092,21 +1206,19 @@ class MultiAgentHighwayPOEnvAblationMergeInfo(MultiAgentHighwayPOEnvMerge4):
         return Box(-float('inf'), float('inf'), shape=(7,), dtype=np.float32)
 
     def get_state(self):
-        states = super().get_state()
-        for rl_id in states:
-            edge = self.k.vehicle.get_edge(rl_id)
-            state_rl_id = list(states[rl_id])
-            state_rl_id.pop(-1)
-            state_rl_id.pop(-1)
-            states[rl_id] = state_rl_id
-        return states
+        rl_ids, obs_matrix = self._get_state_matrix()
+        obs_matrix = np.delete(obs_matrix, [7, 8], axis=1)
+        return {rl_id: obs_matrix[i] for i, rl_id in enumerate(rl_ids)}
 
 class MultiAgentHighwayPOEnvAblationMergeInfoCollaborate(MultiAgentHighwayPOEnvAblationMergeInfo):
     def compute_reward(self, rl_actions, **kwargs):
         if rl_actions is None:
             return {}
 
-        rewards = {}
+        rl_ids = self._get_rl_ids()
+        if not rl_ids:
+            return {}
+
         if "eta1" in self.env_params.additional_params.keys():
             eta1 = self.env_params.additional_params["eta1"]
             eta2 = self.env_params.additional_params["eta2"]
@@ -1116,7 +1228,5 @@ class MultiAgentHighwayPOEnvAblationMergeInfoCollaborate(MultiAgentHighwayPOEnvA
         reward1 = -0.1
         reward2 = average_velocity(self)/300
         reward  = reward1 * eta1 + reward2 * eta2
-        for rl_id in self.k.vehicle.get_rl_ids():
-            rewards[rl_id] = reward
-        return rewards
+        return dict.fromkeys(rl_ids, reward)
 
@@ -17,7 +17,12 @@ from flow.envs import LaneChangeAccelEnv, LaneChangeAccelPOEnv, AccelEnv, \
     WaveAttenuationEnv, WaveAttenuationPOEnv, MergePOEnv, \
     TestEnv, BottleneckDesiredVelocityEnv, BottleneckEnv, BottleneckAccelEnv
 from flow.envs.ring.wave_attenuation import v_eq_max_function
-from flow.envs.multiagent import MultiAgentHighwayPOEnv
+from flow.envs.multiagent import MultiAgentHighwayPOEnv, \
+    MultiAgentHighwayPOEnvMerge4, MultiAgentHighwayPOEnvAblationDistance, \
+    MultiAgentHighwayPOEnvAblationConjestion, \
+    MultiAgentHighwayPOEnvAblationConjestionDistance, \
+    MultiAgentHighwayPOEnvAblationConjestionMergeInfo, \
+    MultiAgentHighwayPOEnvAblationMergeInfo
 
 os.environ["TEST_FLAG"] = "True"
 
@@ -1036,6 +1041,197 @@ class TestMultiAgentHighwayPOEnv(unittest.TestCase):
         self.assertDictEqual(env.compute_reward({"rl_0": 0}, fail=False),
                              {"rl_0": 5})
 
+    def test_get_state(self):
+        """Checks the observations against values computed by hand."""
+        # create the environment
+        env = MultiAgentHighwayPOEnv(
+            sim_params=self.sim_params,
+            network=self.network,
+            env_params=self.env_params
+        )
+        env.reset()
+        max_speed = env.k.network.max_speed()
+        max_length = env.k.network.length()
+
+        # visible leader and follower
+        env.k.vehicle.test_set_speed("rl_0", 10)
+        env.k.vehicle.test_set_speed("human_0", 5)
+        env.k.vehicle.set_leader("rl_0", "human_0")
+        env.k.vehicle.set_follower("rl_0", "human_0")
+        env.k.vehicle.set_headway("rl_0", 20)
+        env.k.vehicle.set_headway("human_0", 30)
+        obs = env.get_state()
+        self.assertListEqual(list(obs.keys()), ["rl_0"])
+        self.assertEqual(obs["rl_0"].dtype, np.float32)
+        np.testing.assert_array_almost_equal(
+            obs["rl_0"],
+            [10 / max_speed, (5 - 10) / max_speed, 20 / max_length,
+             (10 - 5) / max_speed, 30 / max_length])
+
+        # no leader: max speed and max length. no follower: 0 and max length
+        env.k.vehicle.set_leader("rl_0", "")
+        env.k.vehicle.set_follower("rl_0", None)
+        obs = env.get_state()
+        self.assertEqual(obs["rl_0"].dtype, np.float32)
+        np.testing.assert_array_almost_equal(
+            obs["rl_0"],
+            [10 / max_speed, (max_speed - 10) / max_speed, 1,
+             10 / max_speed, 1])
+
+        # a visible leader with no follower
+        env.k.vehicle.set_leader("rl_0", "human_0")
+        obs = env.get_state()
+        np.testing.assert_array_almost_equal(
+            obs["rl_0"],
+            [10 / max_speed, (5 - 10) / max_speed, 20 / max_length,
+             10 / max_speed, 1])
+
+        env.terminate()
+
+    def test_ablation_get_state(self):
+        """Ensures that the ablation envs drop the right Merge4 features."""
+        vehicles = VehicleParams()
+        vehicles.add("rl", acceleration_controller=(RLController, {}),
+                     num_vehicles=1)
+        vehicles.add("human", acceleration_controller=(IDMController, {}),
+                     num_vehicles=1)
+        network = MergeNetwork(
+            name="test_merge",
+            vehicles=vehicles,
+            net_params=NetParams(additional_params=MERGE_PARAMS.copy()),
+        )
+
+        # Merge4 features: 0-4 speeds and headways, 5 distance to the merge,
+        # 6 congestion ahead, 7-8 distance and speed of the merging vehicle
+        kept_features = {
+            MultiAgentHighwayPOEnvAblationDistance:
+                [0, 1, 2, 3, 4, 6, 7, 8],
+            MultiAgentHighwayPOEnvAblationConjestion:
+                [0, 1, 2, 3, 4, 5, 7, 8],
+            MultiAgentHighwayPOEnvAblationConjestionDistance:
+                [0, 1, 2, 3, 4, 7, 8],
+            MultiAgentHighwayPOEnvAblationConjestionMergeInfo:
+                [0, 1, 2, 3, 4, 5],
+            MultiAgentHighwayPOEnvAblationMergeInfo:
+                [0, 1, 2, 3, 4, 5, 6],
+        }
+        for env_class, kept in kept_features.items():
+            env = env_class(
+                sim_params=self.sim_params,
+                network=network,
+                env_params=self.env_params
+            )
+            env.reset()
+
+            obs = env.get_state()
+            full_obs = MultiAgentHighwayPOEnvMerge4.get_state(env)
+            self.assertListEqual(list(obs.keys()), list(full_obs.keys()))
+            for rl_id in obs:
+                self.assertEqual(obs[rl_id].shape,
+                                 env.observation_space.shape)
+                np.testing.assert_array_equal(
+                    obs[rl_id], full_obs[rl_id][kept])
+
+            env.terminate()
+
+    def test_lead_data_cache(self):
+        """Ensures that leader data is only reused within a simulation step."""
+        # create the environment
+        env = MultiAgentHighwayPOEnv(
+            sim_params=self.sim_params,
+            network=self.network,
+            env_params=self.env_params
+        )
+        env.reset()
+
+        # the leader data of get_state is reused within the same step, but
+        # the speed is always read from the kernel
+        env.k.vehicle.test_set_speed("rl_0", 5)
+        env._last_obs_cache = (env.k.vehicle.time_counter,
+                               {"rl_0": ("stale", 1.0)})
+        self.assertTupleEqual(env._get_lead_data("rl_0"), (5, "stale", 1.0))
+
+        # the kernel is queried once it has been updated
+        env.step({"rl_0": np.array([0])})
+        env._last_obs_cache = (env.k.vehicle.time_counter - 1,
+                               {"rl_0": ("stale", 1.0)})
+        self.assertTupleEqual(
+            env._get_lead_data("rl_0"),
+            (env.k.vehicle.get_speed("rl_0"),
+             env.k.vehicle.get_leader("rl_0"),
+             env.k.vehicle.get_headway("rl_0")))
+
+        env.terminate()
+
+    def test_rl_ids_cache(self):
+        """Ensures that the RL ids are fetched again after kernel updates."""
+        # create the environment
+        env = MultiAgentHighwayPOEnv(
+            sim_params=self.sim_params,
+            network=self.network,
+            env_params=self.env_params
+        )
+
+        # the ids can be read before the kernel is first updated
+        self.assertListEqual(env._get_rl_ids(), env.k.vehicle.get_rl_ids())
+
+        env.reset()
+
+        # the ids are only fetched once per simulation step
+        rl_ids = env._get_rl_ids()
+        self.assertListEqual(rl_ids, ["rl_0"])
+        self.assertIs(env._get_rl_ids(), rl_ids)
+
+        # stale ids are dropped once the kernel is updated
+        env._step_rl_ids = (env.k.vehicle.time_counter, ["stale"])
+        self.assertListEqual(env._get_rl_ids(), ["stale"])
+        env.step({"rl_0": np.array([0])})
+        self.assertListEqual(env._get_rl_ids(), env.k.vehicle.get_rl_ids())
+
+        # stale ids are dropped upon reset
+        env._step_rl_ids = (env.k.vehicle.time_counter, ["stale"])
+        env.reset()
+        self.assertListEqual(env._get_rl_ids(), env.k.vehicle.get_rl_ids())
+
+        env.terminate()
+
+    def test_ids_by_edge_cache(self):
+        """Ensures that the edge vehicles are fetched again after updates."""
+        # create the environment
+        env = MultiAgentHighwayPOEnv(
+            sim_params=self.sim_params,
+            network=self.network,
+            env_params=self.env_params
+        )
+
+        # the vehicles can be read before the kernel is first updated
+        self.assertListEqual(env._get_ids_by_edge(["highway_0"]), [])
+
+        env.reset()
+        edge = env.k.vehicle.get_edge("rl_0")
+
+        # the vehicles of an edge are only fetched once per simulation step
+        edge_vehs = env._get_ids_by_edge(edge)
+        self.assertListEqual(edge_vehs, env.k.vehicle.get_ids_by_edge(edge))
+        self.assertIs(env._get_ids_by_edge(edge), edge_vehs)
+        self.assertListEqual(env._get_ids_by_edge([edge]), edge_vehs)
+
+        # stale vehicles are dropped once the kernel is updated
+        env._edge_vehs[edge] = ["stale"]
+        self.assertListEqual(env._get_ids_by_edge(edge), ["stale"])
+        env.step({"rl_0": np.array([0])})
+        self.assertListEqual(env._get_ids_by_edge(edge),
+                             env.k.vehicle.get_ids_by_edge(edge))
+
+        # stale vehicles are dropped upon reset
+        env._get_ids_by_edge(edge)
+        env._edge_vehs[edge] = ["stale"]
+        env.reset()
+        self.assertListEqual(env._get_ids_by_edge(edge),
+                             env.k.vehicle.get_ids_by_edge(edge))
+
+        env.terminate()
+
     def test_observed(self):
         """Ensures that the observed ids are returning the correct vehicles."""
         self.assertTrue(